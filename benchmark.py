@@ -0,0 +1,180 @@
+"""홍보방/활동 로그를 대량으로 채운 SQLite DB에서 관리자 페이지 주요 경로의 응답 시간을 잽니다.
+
+Telethon은 가짜 모듈로 바꿔 끼우므로 실제 텔레그램 계정이나 네트워크 없이 실행됩니다.
+
+    python benchmark.py                       # 10,000 / 100,000 행으로 각 경로 5회씩
+    python benchmark.py --sizes 20000 --repeat 3 --json bench.json
+"""
+import os
+import sys
+import io
+import json
+import time
+import types
+import random
+import argparse
+import datetime
+import statistics
+import tempfile
+import tracemalloc
+
+
+# --- Telethon 대체 모듈 ---
+def stub_telethon():
+    class StringSession:
+        def __init__(self, string=None):
+            self._entities = set()
+
+    class TelegramClient:
+        def __init__(self, *args, **kwargs):
+            raise RuntimeError("벤치마크에서는 Telegram에 연결하지 않습니다.")
+
+    class RPCError(Exception):
+        seconds = 0
+
+    telethon = types.ModuleType('telethon')
+    telethon.TelegramClient = TelegramClient
+    sessions = types.ModuleType('telethon.sessions')
+    sessions.StringSession = StringSession
+    errors = types.ModuleType('telethon.errors')
+    rpcerrorlist = types.ModuleType('telethon.errors.rpcerrorlist')
+    for name in ('FloodWaitError', 'UserIsBlockedError', 'PeerFloodError'):
+        setattr(rpcerrorlist, name, type(name, (RPCError,), {}))
+    sys.modules.update({'telethon': telethon, 'telethon.sessions': sessions, 'telethon.errors': errors, 'telethon.errors.rpcerrorlist': rpcerrorlist})
+
+
+# --- 데이터 준비 ---
+def seed(app_module, db, size, chunk=5000):
+    groups = [f"그룹{index:02d}" for index in range(20)]
+    statuses = ['✅ OK (홍보방)', '❌ Error: ChannelPrivateError', '확인 안됨']
+    now = datetime.datetime.now(datetime.timezone.utc)
+    daily = {}
+    with db.transaction():
+        for start in range(0, size, chunk):
+            rooms = [(str(-1000000000000 - index), f"홍보방 {index}", random.choice(groups), random.choice(statuses)) for index in range(start, min(start + chunk, size))]
+            db.insert_many('promo_rooms', ('chat_id', 'room_name', 'room_group', 'last_status'), rooms)
+            logs = []
+            for _ in range(len(rooms)):
+                timestamp = now - datetime.timedelta(seconds=random.randint(0, 60 * 24 * 3600))
+                status = 'success' if random.random() < 0.9 else 'error'
+                details = "✅ [Userbot] 100개 활성 방에 메시지 발송 완료" if status == 'success' else "❌ [Userbot] 스케줄러 오류: 벤치마크"
+                logs.append((timestamp.strftime("%Y-%m-%d %H:%M:%S"), details, status, 100, random.randint(1000, 900000)))
+                day = timestamp.astimezone(app_module.KST).strftime("%Y-%m-%d")
+                success, error = daily.get(day, (0, 0))
+                daily[day] = (success + 1, error) if status == 'success' else (success, error + 1)
+            db.insert_many('activity_log', ('timestamp', 'details', 'status', 'room_count', 'duration_ms'), logs)
+        db.insert_many('activity_daily', ('day', 'success_count', 'error_count'), [(day, *counts) for day, counts in daily.items()])
+
+
+# --- 측정 대상 경로 ---
+def walk_rooms(client):
+    pages, after_id = 0, None
+    while True:
+        data = client.get('/api/rooms', query_string={'limit': 500, **({'after_id': after_id} if after_id else {})}).get_json()
+        pages += 1
+        after_id = data['next_after_id']
+        if not after_id:
+            return pages
+
+def build_scenarios(client, db):
+    exported = {}
+
+    def export():
+        # 응답을 조각 단위로 소비만 하고 쌓아 두지 않아야 최대 메모리가 서버 쪽 사용량만 반영합니다.
+        response = client.get('/export_rooms')
+        size = sum(len(chunk) for chunk in response.response)
+        response.close()
+        return size
+
+    def import_rooms():
+        response = client.post('/import_rooms', data={'file': (io.BytesIO(exported['body']), 'rooms.csv')}, content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_data(as_text=True)
+
+    def clear_rooms():
+        # 가져올 CSV는 처음 한 번만 내보내 두고, 매번 빈 테이블에 새로 가져옵니다.
+        if 'body' not in exported:
+            response = client.get('/export_rooms')
+            exported['body'] = b''.join(response.response)
+            response.close()
+        db.execute_db("DELETE FROM promo_rooms")
+
+    # (이름, 측정 함수, 측정 전 준비 함수)
+    return [
+        ('dashboard  GET /', lambda: client.get('/'), None),
+        ('rooms      GET /api/rooms (첫 페이지)', lambda: client.get('/api/rooms'), None),
+        ('rooms      GET /api/rooms (그룹+상태 필터)', lambda: client.get('/api/rooms', query_string={'group': '그룹07', 'last_status': 'error'}), None),
+        ('rooms      전체 순회 (500개씩)', lambda: walk_rooms(client), None),
+        ('groups     GET /api/rooms/groups', lambda: client.get('/api/rooms/groups'), None),
+        ('logs       GET /logs', lambda: client.get('/logs'), None),
+        ('logs       GET /api/logs (실패, 기간)', lambda: client.get('/api/logs', query_string={'status': 'error', 'date_from': '2000-01-01', 'date_to': '2100-01-01'}), None),
+        ('export     GET /export_rooms', export, None),
+        ('import     POST /import_rooms', import_rooms, clear_rooms),
+    ]
+
+def measure(func, prepare, repeat):
+    timings = []
+    for _ in range(repeat):
+        if prepare:
+            prepare()
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    if prepare:
+        prepare()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'min_ms': min(timings), 'median_ms': statistics.median(timings), 'max_ms': max(timings), 'peak_kb': peak / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite 대량 데이터 기준 관리자 페이지 벤치마크")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help="홍보방/로그 행 수 (각각 같은 수로 채움)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help="결과를 저장할 JSON 파일 경로")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='userbot-bench-')
+    os.environ['SQLITE_PATH'] = os.path.join(workdir, 'bench_0.db')
+    os.environ.pop('DATABASE_URL', None)
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    stub_telethon()
+    random.seed(0)
+
+    import db
+    import metrics
+    import userbot_app
+    userbot_app.scheduler.shutdown(wait=False)
+
+    results = {}
+    for size in args.sizes:
+        db.close_all()
+        db.SQLITE_PATH = os.path.join(workdir, f'bench_{size}.db')
+        userbot_app.init_db()
+        started = time.perf_counter()
+        seed(userbot_app, db, size)
+        print(f"\n=== {size:,}개 방 / {size:,}개 로그 (데이터 준비 {time.perf_counter() - started:.1f}초) ===")
+        print(f"{'경로':<44}{'min ms':>10}{'median ms':>12}{'max ms':>10}{'peak KB':>10}")
+
+        client = userbot_app.app.test_client()
+        with client.session_transaction() as flask_session:
+            flask_session['logged_in'] = True
+        results[size] = {}
+        for name, func, prepare in build_scenarios(client, db):
+            result = measure(func, prepare, args.repeat)
+            results[size][name] = result
+            print(f"{name:<44}{result['min_ms']:>10.1f}{result['median_ms']:>12.1f}{result['max_ms']:>10.1f}{result['peak_kb']:>10.0f}")
+
+    print("\n=== DB 문장별 누적 시간 상위 10개 ===")
+    statements = sorted(metrics.DB_QUERY_SECONDS.snapshot().items(), key=lambda item: item[1][1], reverse=True)[:10]
+    for (statement,), (count, total) in statements:
+        print(f"{total * 1000:>10.1f} ms {count:>7}회  {statement[:100]}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
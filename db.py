@@ -0,0 +1,261 @@
+import os
+import itertools
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from urllib.parse import urlparse
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import execute_batch, execute_values
+from metrics import DB_QUERY_SECONDS, DB_QUERY_ERRORS, normalize_statement
+
+# --- 기본 설정 ---
+DATABASE_URL = os.getenv('DATABASE_URL')
+IS_POSTGRES = bool(DATABASE_URL)
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'bot_config.db')
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+
+WRITE_PREFIXES = ('insert', 'update', 'delete')
+
+_pool = None
+_pool_pid = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+_cursor_names = itertools.count(1)
+
+
+# --- 연결 관리 ---
+# Postgres는 프로세스 단위 커넥션 풀을, SQLite는 스레드마다 하나의 WAL 모드 연결을 재사용합니다.
+# 두 경우 모두 연결은 autocommit 상태로 두고, transaction() 안에서만 명시적으로 BEGIN/COMMIT 합니다.
+def _postgres_pool():
+    global _pool, _pool_pid, _pool_slots
+    # gunicorn 등에서 fork 된 경우 부모 프로세스의 소켓을 공유하지 않도록 풀을 새로 만듭니다.
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                url = urlparse(DATABASE_URL)
+                _pool = pg_pool.ThreadedConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX,
+                    dbname=url.path[1:], user=url.username, password=url.password, host=url.hostname, port=url.port)
+                # getconn()은 풀이 비면 기다리지 않고 PoolError를 내므로, 빈 연결이 생길 때까지 세마포어로 기다립니다.
+                _pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+                _pool_pid = os.getpid()
+    return _pool
+
+def _sqlite_connection():
+    conn = getattr(_local, 'sqlite_conn', None)
+    if conn is None:
+        conn = sqlite3.connect(SQLITE_PATH, isolation_level=None, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _local.sqlite_conn = conn
+    return conn
+
+@contextmanager
+def _acquire():
+    # transaction() 안에서 호출되면 진행 중인 트랜잭션의 연결을 그대로 사용합니다.
+    conn = getattr(_local, 'tx_conn', None)
+    if conn is not None:
+        yield conn
+        return
+    if not IS_POSTGRES:
+        yield _sqlite_connection()
+        return
+    pool = _postgres_pool()
+    slots = _pool_slots
+    if not slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise pg_pool.PoolError(f"{DB_POOL_TIMEOUT:g}초 동안 사용할 수 있는 DB 연결이 없습니다. (DB_POOL_MAX={DB_POOL_MAX})")
+    try:
+        conn = pool.getconn()
+        conn.autocommit = True
+        try:
+            yield conn
+        finally:
+            pool.putconn(conn, close=bool(conn.closed))
+    finally:
+        slots.release()
+
+def close_all():
+    global _pool
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
+    conn = getattr(_local, 'sqlite_conn', None)
+    if conn is not None:
+        conn.close()
+        _local.sqlite_conn = None
+
+
+# --- 쿼리 실행 ---
+@lru_cache(maxsize=512)
+def translate(query):
+    # '?' 자리표시자를 드라이버 형식으로 바꾸고, 문장별 결과를 캐시합니다.
+    return query.replace('?', '%s') if IS_POSTGRES else query
+
+def _observe(query, seconds, failed=False):
+    # 문장 한 번 실행의 소요 시간과 오류 여부를 metrics에 기록합니다.
+    statement = normalize_statement(query)
+    if failed:
+        DB_QUERY_ERRORS.inc(statement=statement)
+    DB_QUERY_SECONDS.observe(seconds, statement=statement)
+
+@contextmanager
+def _timed(query):
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except Exception:
+        failed = True
+        raise
+    finally:
+        _observe(query, time.perf_counter() - started, failed)
+
+def rows_to_dicts(cursor, rows):
+    columns = [col[0] for col in cursor.description]
+    return [dict(zip(columns, row)) for row in rows]
+
+def query_db(query, args=(), one=False):
+    with _acquire() as conn:
+        cursor = conn.cursor()
+        try:
+            with _timed(query):
+                cursor.execute(translate(query), args)
+                if query.lower().strip().startswith(WRITE_PREFIXES):
+                    return
+                rows = cursor.fetchall()
+            rv = rows_to_dicts(cursor, rows)
+        finally:
+            cursor.close()
+        return (rv[0] if rv else None) if one else rv
+
+def iter_query(query, args=(), batch_size=1000):
+    """결과를 한꺼번에 메모리에 올리지 않고 batch_size 행씩 읽어 dict로 하나씩 돌려주는 제너레이터입니다.
+
+    Postgres는 서버 측(named) 커서를 쓰므로 제너레이터가 끝나거나 닫힐 때까지 연결 하나를 점유합니다.
+    """
+    with _acquire() as conn:
+        in_transaction = getattr(_local, 'tx_conn', None) is conn
+        if IS_POSTGRES:
+            # named 커서는 트랜잭션 안에서만 쓸 수 있습니다.
+            if not in_transaction:
+                conn.autocommit = False
+            cursor = conn.cursor(name=f"iter_query_{next(_cursor_names)}")
+            cursor.itersize = batch_size
+        else:
+            cursor = conn.cursor()
+        # 소비하는 쪽에서 쓰는 시간은 빼고 execute/fetch에 걸린 시간을 합쳐 한 번의 실행으로 기록합니다.
+        elapsed, failed = 0.0, False
+        try:
+            started = time.perf_counter()
+            cursor.execute(translate(query), args)
+            elapsed += time.perf_counter() - started
+            columns = None
+            while True:
+                started = time.perf_counter()
+                rows = cursor.fetchmany(batch_size)
+                elapsed += time.perf_counter() - started
+                if not rows:
+                    break
+                if columns is None:
+                    columns = [col[0] for col in cursor.description]
+                for row in rows:
+                    yield dict(zip(columns, row))
+        except Exception:
+            failed = True
+            raise
+        finally:
+            _observe(query, elapsed, failed)
+            cursor.close()
+            if IS_POSTGRES and not in_transaction and not conn.closed:
+                conn.rollback()
+                conn.autocommit = True
+
+def execute_db(query, args=()):
+    with _acquire() as conn:
+        cursor = conn.cursor()
+        try:
+            with _timed(query):
+                cursor.execute(translate(query), args)
+            return cursor.rowcount
+        finally:
+            cursor.close()
+
+def execute_many(query, seq):
+    # 같은 문장을 여러 인자 묶음으로 실행합니다. (Postgres는 execute_batch로 왕복 횟수를 줄입니다)
+    with _acquire() as conn:
+        cursor = conn.cursor()
+        try:
+            with _timed(query):
+                if IS_POSTGRES:
+                    execute_batch(cursor, translate(query), seq)
+                else:
+                    cursor.executemany(query, seq)
+        finally:
+            cursor.close()
+
+def table_columns(table):
+    # 마이그레이션 판단용으로 테이블의 컬럼 이름 집합을 돌려줍니다.
+    if IS_POSTGRES:
+        rows = query_db("SELECT column_name AS name FROM information_schema.columns WHERE table_name = ?", (table,))
+    else:
+        rows = query_db(f"PRAGMA table_info({table})")
+    return {row['name'] for row in rows}
+
+def insert_many(table, columns, rows, on_conflict=None):
+    """여러 행을 한 번에 INSERT 하고 실제로 추가된 행 수를 돌려줍니다.
+
+    Postgres는 execute_values로 한 문장에 묶어 보내고, SQLite는 executemany를 사용합니다.
+    on_conflict 예: "(chat_id) DO NOTHING"
+    """
+    if not rows:
+        return 0
+    column_sql = ', '.join(columns)
+    conflict_sql = f" ON CONFLICT {on_conflict}" if on_conflict else ''
+    with _acquire() as conn:
+        cursor = conn.cursor()
+        try:
+            if IS_POSTGRES:
+                sql = f"INSERT INTO {table} ({column_sql}) VALUES %s{conflict_sql} RETURNING 1"
+                with _timed(sql):
+                    return len(execute_values(cursor, sql, rows, page_size=len(rows), fetch=True))
+            placeholders = ', '.join('?' for _ in columns)
+            sql = f"INSERT INTO {table} ({column_sql}) VALUES ({placeholders}){conflict_sql}"
+            with _timed(sql):
+                cursor.executemany(sql, rows)
+            return cursor.rowcount
+        finally:
+            cursor.close()
+
+@contextmanager
+def transaction():
+    """여러 문장이 하나의 연결과 한 번의 커밋을 공유하도록 묶습니다.
+
+    블록 안의 query_db/execute_db 호출도 같은 연결을 사용하며, 예외가 나면 전체가 롤백됩니다.
+    중첩해서 사용하면 가장 바깥 블록에서만 커밋합니다.
+    """
+    if getattr(_local, 'tx_conn', None) is not None:
+        yield _local.tx_conn
+        return
+    with _acquire() as conn:
+        if IS_POSTGRES:
+            conn.autocommit = False
+        else:
+            # 읽은 뒤 쓰는 트랜잭션이 WAL에서 곧바로 'database is locked'로 실패하지 않도록 처음부터 쓰기 잠금을 잡습니다.
+            # (잠금을 기다리는 동안은 busy timeout이 적용됩니다)
+            conn.execute('BEGIN IMMEDIATE')
+        _local.tx_conn = conn
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            _local.tx_conn = None
+            if IS_POSTGRES and not conn.closed:
+                conn.autocommit = True
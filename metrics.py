@@ -0,0 +1,98 @@
+import re
+import threading
+import bisect
+from functools import lru_cache
+
+# --- 프로세스 내 메트릭 (Prometheus 텍스트 형식) ---
+# 외부 의존성 없이 라우트 응답 시간과 DB 문장별 실행 시간을 모읍니다. gunicorn 워커마다 따로 집계됩니다.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_placeholder_list = re.compile(r"\(\s*(\?|%s)(\s*,\s*(\?|%s))+\s*\)")
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(labelnames, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, seconds, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + seconds)
+
+    def snapshot(self):
+        # {라벨 값 튜플: (관측 횟수, 합계 초)}
+        with self._lock:
+            return {key: (sum(counts), total) for key, (counts, total) in self._values.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(counts), total) for key, (counts, total) in self._values.items())
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            cumulative += counts[-1]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render_all():
+    return '\n'.join(line for metric in _registry for line in metric.render()) + '\n'
+
+@lru_cache(maxsize=512)
+def normalize_statement(query):
+    # 줄바꿈/연속 공백과 IN (?, ?, ...) 같은 자리표시자 목록을 합쳐, 인자 개수와 관계없이 같은 문장이 하나의 라벨로 모이게 합니다.
+    return _placeholder_list.sub('(?, ...)', ' '.join(query.split()))
+
+
+HTTP_REQUEST_SECONDS = Histogram('userbot_http_request_duration_seconds', 'Flask 라우트별 응답 시간', ('method', 'route', 'status'))
+DB_QUERY_SECONDS = Histogram('userbot_db_query_duration_seconds', 'DB 문장별 실행 시간', ('statement',))
+DB_QUERY_ERRORS = Counter('userbot_db_query_errors_total', 'DB 문장별 오류 횟수', ('statement',))
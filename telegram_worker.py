@@ -0,0 +1,112 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from telethon import TelegramClient
+from telethon.sessions import StringSession
+from db import query_db, insert_many
+
+ENTITY_COLUMNS = ('id', 'hash', 'username', 'phone', 'name')
+
+
+# --- 엔티티 캐시를 DB에 보존하는 세션 ---
+class DbEntitySession(StringSession):
+    """StringSession과 같지만, 확인한 엔티티와 access hash를 telegram_entities 테이블에 저장합니다.
+
+    재시작 후에도 시작 시점에 캐시를 다시 불러오므로 이미 확인한 방은 다시 조회하지 않아도 됩니다.
+    """
+    def __init__(self, string=None):
+        super().__init__(string)
+        rows = query_db("SELECT id, hash, username, phone, name FROM telegram_entities")
+        # id별 최신 행을 dict로 들고, 부모 클래스의 조회 메서드는 그 values() 뷰를 그대로 순회하게 합니다.
+        self._rows = {row['id']: tuple(row[column] for column in ENTITY_COLUMNS) for row in rows}
+        self._entities = self._rows.values()
+        # DB 쓰기는 이벤트 루프를 막지 않도록 스레드 하나에서 순서대로 처리합니다. (같은 id의 갱신 순서 보장)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='telegram-entities')
+        self._last_write = None
+
+    def process_entities(self, tlo):
+        # 새로 보거나 바뀐 엔티티만 반영합니다. (받은 엔티티 수에만 비례)
+        rows = [row for row in self._entities_to_rows(tlo) if self._rows.get(row[0]) != row]
+        if not rows:
+            return
+        rows = list({row[0]: row for row in rows}.values())
+        self._rows.update((row[0], row) for row in rows)
+        self._last_write = self._writer.submit(
+            insert_many, 'telegram_entities', ENTITY_COLUMNS, rows,
+            on_conflict="(id) DO UPDATE SET hash = excluded.hash, username = excluded.username, phone = excluded.phone, name = excluded.name")
+        self._last_write.add_done_callback(_log_write_error)
+
+    def get_entity_rows_by_id(self, id, exact=True):
+        if exact:
+            row = self._rows.get(id)
+            return (row[0], row[1]) if row else None
+        return super().get_entity_rows_by_id(id, exact)
+
+    def close(self):
+        # 연결을 끊을 때 아직 남은 쓰기가 끝날 때까지 기다립니다.
+        if self._last_write is not None:
+            wait([self._last_write])
+
+
+def _log_write_error(future):
+    if not future.cancelled() and future.exception() is not None:
+        print(f"텔레그램 엔티티 저장 오류: {future.exception()}")
+
+
+# --- 전용 이벤트 루프 스레드 ---
+class TelegramWorker:
+    """하나의 TelegramClient를 전용 이벤트 루프 스레드에서 계속 연결된 상태로 유지합니다.
+
+    다른 스레드(Flask 핸들러, 스케줄러)는 submit(func, *args)로 `async def func(client, *args)`를 넘기고 결과를 받습니다.
+    """
+    def __init__(self, session_string, api_id, api_hash):
+        self._session_string = session_string
+        self._api_id = api_id
+        self._api_hash = api_hash
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._pid = None
+        self._client = None
+        self._connect_lock = None
+
+    def _ensure_loop(self):
+        # fork 된 자식 프로세스에서는 부모의 스레드가 없으므로 루프를 새로 만듭니다.
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name='telegram-worker', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+                self._client = None
+                self._connect_lock = None
+            return self._loop
+
+    async def _get_client(self):
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._client is None:
+                self._client = TelegramClient(DbEntitySession(self._session_string), int(self._api_id), self._api_hash)
+            if not self._client.is_connected():
+                await self._client.connect()
+        return self._client
+
+    async def _call(self, func, args):
+        client = await self._get_client()
+        return await func(client, *args)
+
+    def submit_nowait(self, func, *args):
+        # concurrent.futures.Future를 돌려줍니다.
+        return asyncio.run_coroutine_threadsafe(self._call(func, args), self._ensure_loop())
+
+    def submit(self, func, *args, timeout=None):
+        return self.submit_nowait(func, *args).result(timeout)
+
+    def stop(self):
+        if self._loop is None or self._pid != os.getpid():
+            return
+        if self._client is not None and self._client.is_connected():
+            asyncio.run_coroutine_threadsafe(self._client.disconnect(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
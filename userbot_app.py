@@ -1,34 +1,78 @@
 import os
+import hmac
+import atexit
 import asyncio
 import sqlite3
-from urllib.parse import urlparse
 import psycopg2
 import datetime
+import time
 import random
 import re
 import csv
 import io
-from flask import Flask, render_template, request, jsonify, Response, redirect, url_for, session
+import codecs
+import json
+import concurrent.futures
+import zlib
+import threading
+from flask import Flask, render_template, request, jsonify, Response, redirect, url_for, session, g
 from apscheduler.schedulers.background import BackgroundScheduler
-from telethon.sync import TelegramClient
-from telethon.sessions import StringSession
+from apscheduler.schedulers.base import STATE_RUNNING, STATE_PAUSED
 from telethon.errors.rpcerrorlist import FloodWaitError, UserIsBlockedError, PeerFloodError
 from functools import wraps
+from db import DATABASE_URL, query_db, iter_query, execute_db, execute_many, insert_many, table_columns, transaction
+from telegram_worker import TelegramWorker
+from metrics import HTTP_REQUEST_SECONDS, render_all as render_metrics
 
 # --- 기본 설정 ---
 API_ID = os.getenv("API_ID")
 API_HASH = os.getenv("API_HASH")
 SESSION_STRING = os.getenv("SESSION_STRING")
-DATABASE_URL = os.getenv('DATABASE_URL')
 PHOTO_STORAGE_ID_STR = os.getenv('PHOTO_STORAGE_ID')
 PHOTO_STORAGE_ID = int(PHOTO_STORAGE_ID_STR) if PHOTO_STORAGE_ID_STR else None
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
 SECRET_KEY = os.getenv("SECRET_KEY")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+ROOM_IMPORT_CHUNK = int(os.getenv('ROOM_IMPORT_CHUNK', 1000))
+EXPORT_FLUSH_BYTES = 64 * 1024
+ESCAPED_BYTES = re.compile('[\udc80-\udcff]')  # surrogateescape로 남은, UTF-8로 읽지 못한 바이트
+KST = datetime.timezone(datetime.timedelta(hours=9))
+LOG_RETENTION_DAYS = int(os.getenv('LOG_RETENTION_DAYS', 30))
+LOG_PAGE_SIZE = 50
+LOG_PAGE_MAX = 200
+LOG_COMPACT_BATCH = 5000
+ROOM_PAGE_SIZE = 100
+ROOM_PAGE_MAX = 500
+ROOM_STATUS_FILTERS = {'ok': ('LIKE', '✅%'), 'error': ('LIKE', '❌%'), 'unchecked': ('=', '확인 안됨')}
+DIALOG_CACHE_TTL = int(os.getenv('DIALOG_CACHE_TTL', 300))
+DIALOG_FULL_SYNC_INTERVAL = 24 * 60 * 60
+REGISTER_REFRESH_TIMEOUT = 10
+ROOM_CHECK_CONCURRENCY = int(os.getenv('ROOM_CHECK_CONCURRENCY', 4))
+ROOM_CHECK_BATCH = 50
+ROOM_CHECK_HEARTBEAT = 120
+LOG_TS_SQL = "strftime('%Y-%m-%d %H:%M:%S', timestamp, '+9 hours')" if not DATABASE_URL else "to_char(timestamp AT TIME ZONE 'Asia/Seoul', 'YYYY-MM-DD HH24:MI:SS')"
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = SECRET_KEY
 
+# 모든 관리자 기능과 스케줄러가 함께 쓰는 단일 Telegram 연결
+telegram = TelegramWorker(SESSION_STRING, API_ID, API_HASH)
+
+# --- 요청 시간 측정 ---
+# 스트리밍 응답(CSV 내보내기 등)은 본문 전송 전, 응답 객체를 돌려준 시점까지만 측정됩니다.
+@app.before_request
+def start_request_timer():
+    g.request_started_at = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started_at = g.pop('request_started_at', None)
+    if started_at is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started_at, method=request.method, route=route, status=str(response.status_code))
+    return response
+
 # --- 로그인 확인 '문지기' 기능 (데코레이터) ---
 def login_required(f):
     @wraps(f)
@@ -46,34 +90,7 @@ def async_login_required(f):
         return await f(*args, **kwargs)
     return decorated_function
 
-# --- (get_db_connection, query_db, execute_db, process_spintax, init_db 등은 이전과 동일) ---
-def get_db_connection():
-    if DATABASE_URL:
-        url = urlparse(DATABASE_URL)
-        return psycopg2.connect(dbname=url.path[1:], user=url.username, password=url.password, host=url.hostname, port=url.port)
-    else:
-        return sqlite3.connect('bot_config.db')
-
-def query_db(query, args=(), one=False):
-    with get_db_connection() as conn:
-        is_postgres = hasattr(conn, 'tpc_begin')
-        if is_postgres: query = query.replace('?', '%s')
-        cursor = conn.cursor()
-        cursor.execute(query, args)
-        if query.lower().strip().startswith(('insert', 'update', 'delete')):
-            conn.commit()
-            return
-        rv = [dict((cursor.description[idx][0], value) for idx, value in enumerate(row)) for row in cursor.fetchall()]
-        return (rv[0] if rv else None) if one else rv
-
-def execute_db(query, args=()):
-    with get_db_connection() as conn:
-        is_postgres = hasattr(conn, 'tpc_begin')
-        if is_postgres: query = query.replace('?', '%s')
-        cursor = conn.cursor()
-        cursor.execute(query, args)
-        conn.commit()
-
+# --- (process_spintax, init_db 등. DB 접근은 db.py의 풀/트랜잭션 계층을 사용) ---
 def process_spintax(text):
     if not text: return ""
     pattern = re.compile(r'{([^{}]*)}')
@@ -85,22 +102,193 @@ def process_spintax(text):
         text = text[:match.start()] + choice + text[match.end():]
     return text
 
+def migrate_activity_log():
+    # 구버전 activity_log(details만 있던 테이블)에 구조화 컬럼을 추가하고, 기존 행으로 일별 집계를 채웁니다.
+    columns = table_columns('activity_log')
+    if 'status' in columns:
+        return
+    for name, col_type in (('status', 'TEXT'), ('room_count', 'INTEGER'), ('duration_ms', 'INTEGER')):
+        if name not in columns:
+            execute_db(f"ALTER TABLE activity_log ADD COLUMN {name} {col_type}")
+    execute_db("UPDATE activity_log SET status = CASE WHEN substr(details, 1, 1) = ? THEN 'success' ELSE 'error' END", ('✅',))
+    day_sql = "DATE(timestamp, '+9 hours')" if not DATABASE_URL else "to_char(timestamp AT TIME ZONE 'Asia/Seoul', 'YYYY-MM-DD')"
+    execute_db(f"""INSERT INTO activity_daily (day, success_count, error_count)
+        SELECT {day_sql}, SUM(CASE WHEN status = 'success' THEN 1 ELSE 0 END), SUM(CASE WHEN status = 'success' THEN 0 ELSE 1 END)
+        FROM activity_log WHERE timestamp IS NOT NULL GROUP BY {day_sql}
+        ON CONFLICT (day) DO UPDATE SET success_count = excluded.success_count, error_count = excluded.error_count""")
+
+def log_activity(details, status, room_count=None, duration_ms=None):
+    # 로그 한 줄과 오늘(KST) 일별 카운터를 같은 트랜잭션에서 기록합니다.
+    today = datetime.datetime.now(KST).strftime("%Y-%m-%d")
+    success, error = (1, 0) if status == 'success' else (0, 1)
+    with transaction():
+        execute_db("INSERT INTO activity_log (details, status, room_count, duration_ms) VALUES (?, ?, ?, ?)", (details, status, room_count, duration_ms))
+        execute_db("""INSERT INTO activity_daily (day, success_count, error_count) VALUES (?, ?, ?)
+            ON CONFLICT (day) DO UPDATE SET success_count = activity_daily.success_count + excluded.success_count, error_count = activity_daily.error_count + excluded.error_count""", (today, success, error))
+
+# --- 홍보방 목록 조회 ---
+def fetch_rooms(after_id=None, group=None, group_is_null=False, is_active=None, last_status=None, limit=ROOM_PAGE_SIZE):
+    """id 기준 커서로 홍보방 목록을 한 페이지씩 가져옵니다.
+
+    group은 빈 문자열('')도 그대로 비교하고, 그룹이 NULL인 방은 group_is_null=True로 고릅니다.
+    (rooms, next_after_id)를 돌려주며, 마지막 페이지이면 next_after_id는 None 입니다.
+    """
+    conditions, args = [], []
+    if after_id:
+        conditions.append("id > ?")
+        args.append(after_id)
+    if group_is_null:
+        conditions.append("room_group IS NULL")
+    elif group is not None:
+        conditions.append("room_group = ?")
+        args.append(group)
+    if is_active is not None:
+        conditions.append("is_active = ?")
+        args.append(is_active)
+    if last_status in ROOM_STATUS_FILTERS:
+        operator, value = ROOM_STATUS_FILTERS[last_status]
+        conditions.append(f"last_status {operator} ?")
+        args.append(value)
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    rooms = query_db(f"SELECT id, chat_id, room_name, room_group, is_active, last_status FROM promo_rooms {where_sql} ORDER BY id LIMIT ?", (*args, limit + 1))
+    next_after_id = rooms[limit - 1]['id'] if len(rooms) > limit else None
+    return rooms[:limit], next_after_id
+
+def fetch_room_groups():
+    # 그룹별 전체/활성 방 수를 SQL에서 집계합니다.
+    return query_db("SELECT room_group, COUNT(*) AS room_count, SUM(CASE WHEN is_active = 1 THEN 1 ELSE 0 END) AS active_count FROM promo_rooms GROUP BY room_group ORDER BY room_group")
+
+# --- 활동 로그 조회 / 보관 ---
+def kst_day_start(day):
+    # 'YYYY-MM-DD'(KST) 자정을 timestamp 컬럼과 비교할 수 있는 UTC 값으로 바꿉니다. (인덱스 사용 가능)
+    start = datetime.datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=KST).astimezone(datetime.timezone.utc)
+    return start if DATABASE_URL else start.strftime("%Y-%m-%d %H:%M:%S")
+
+def fetch_logs(before_id=None, status=None, date_from=None, date_to=None, limit=LOG_PAGE_SIZE):
+    """id 기준 keyset 페이지네이션으로 활동 로그를 최신순으로 가져옵니다.
+
+    (logs, next_before_id)를 돌려주며, 다음 페이지가 없으면 next_before_id는 None 입니다.
+    """
+    conditions, args = [], []
+    if before_id:
+        conditions.append("id < ?")
+        args.append(before_id)
+    if status:
+        conditions.append("status = ?")
+        args.append(status)
+    if date_from:
+        conditions.append("timestamp >= ?")
+        args.append(kst_day_start(date_from))
+    if date_to:
+        next_day = (datetime.datetime.strptime(date_to, "%Y-%m-%d") + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+        conditions.append("timestamp < ?")
+        args.append(kst_day_start(next_day))
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    logs = query_db(f"SELECT id, {LOG_TS_SQL} AS ts, details, status, room_count, duration_ms FROM activity_log {where_sql} ORDER BY id DESC LIMIT ?", (*args, limit + 1))
+    next_before_id = logs[limit - 1]['id'] if len(logs) > limit else None
+    return logs[:limit], next_before_id
+
+def archive_log_day(day, entries):
+    # 하루치 로그를 zlib으로 압축한 JSON 요약으로 activity_archive에 합칩니다.
+    existing = query_db("SELECT payload FROM activity_archive WHERE day = ?", (day,), one=True)
+    if existing:
+        entries = json.loads(zlib.decompress(bytes(existing['payload']))) + entries
+    success_count = sum(1 for entry in entries if entry['status'] == 'success')
+    total_duration_ms = sum(entry['duration_ms'] or 0 for entry in entries)
+    payload = zlib.compress(json.dumps(entries, ensure_ascii=False).encode('utf-8'))
+    execute_db("""INSERT INTO activity_archive (day, success_count, error_count, total_duration_ms, payload) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (day) DO UPDATE SET success_count = excluded.success_count, error_count = excluded.error_count, total_duration_ms = excluded.total_duration_ms, payload = excluded.payload""",
+        (day, success_count, len(entries) - success_count, total_duration_ms, payload))
+
+def compact_activity_log(retention_days=LOG_RETENTION_DAYS):
+    # 보관 기간이 지난 로그를 일자별 압축 요약으로 옮기고 원본 행은 삭제합니다. (0이면 비활성)
+    if retention_days <= 0:
+        return 0
+    cutoff_day = (datetime.datetime.now(KST) - datetime.timedelta(days=retention_days)).strftime("%Y-%m-%d")
+    cutoff = kst_day_start(cutoff_day)
+    archived = 0
+    while True:
+        with transaction():
+            rows = query_db(f"SELECT id, {LOG_TS_SQL} AS ts, details, status, room_count, duration_ms FROM activity_log WHERE timestamp < ? ORDER BY id LIMIT ?", (cutoff, LOG_COMPACT_BATCH))
+            if not rows:
+                break
+            by_day = {}
+            for row in rows:
+                by_day.setdefault(row['ts'][:10], []).append(row)
+            for day, entries in by_day.items():
+                archive_log_day(day, entries)
+            execute_db("DELETE FROM activity_log WHERE id <= ? AND timestamp < ?", (rows[-1]['id'], cutoff))
+        archived += len(rows)
+    if archived:
+        print(f"활동 로그 {archived}건을 {cutoff_day} 이전 일자별 요약으로 보관했습니다.")
+    return archived
+
+def get_sync_state(name):
+    row = query_db("SELECT value FROM sync_state WHERE name = ?", (name,), one=True)
+    return json.loads(row['value']) if row else {}
+
+def set_sync_state(name, value):
+    execute_db("INSERT INTO sync_state (name, value) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = excluded.value", (name, json.dumps(value)))
+
 def init_db():
     is_postgres = bool(DATABASE_URL)
     config_table_sql = '''CREATE TABLE IF NOT EXISTS config (id INTEGER PRIMARY KEY, message TEXT, photo TEXT, interval_min INTEGER, interval_max INTEGER, scheduler_status TEXT, preview_id TEXT)'''
     promo_rooms_table_sql = f'''CREATE TABLE IF NOT EXISTS promo_rooms (id {'SERIAL' if is_postgres else 'INTEGER'} PRIMARY KEY {'AUTOINCREMENT' if not is_postgres else ''}, chat_id TEXT NOT NULL UNIQUE, room_name TEXT, room_group TEXT DEFAULT '기본', is_active INTEGER DEFAULT 1, last_status TEXT DEFAULT '확인 안됨')'''
-    activity_log_table_sql = f'''CREATE TABLE IF NOT EXISTS activity_log (id {'SERIAL' if is_postgres else 'INTEGER'} PRIMARY KEY {'AUTOINCREMENT' if not is_postgres else ''}, timestamp {'TIMESTAMPTZ' if is_postgres else 'DATETIME'} DEFAULT CURRENT_TIMESTAMP, details TEXT)'''
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(config_table_sql)
-        cursor.execute(promo_rooms_table_sql)
-        cursor.execute(activity_log_table_sql)
-        cursor.execute("SELECT * FROM config WHERE id = 1")
-        if not cursor.fetchone():
-            placeholder = '%s' if is_postgres else '?'
-            insert_sql = f"INSERT INTO config (id, message, photo, interval_min, interval_max, scheduler_status, preview_id) VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder})"
-            cursor.execute(insert_sql, (1, '', '', 30, 40, 'running', ''))
-        conn.commit()
+    activity_log_table_sql = f'''CREATE TABLE IF NOT EXISTS activity_log (id {'SERIAL' if is_postgres else 'INTEGER'} PRIMARY KEY {'AUTOINCREMENT' if not is_postgres else ''}, timestamp {'TIMESTAMPTZ' if is_postgres else 'DATETIME'} DEFAULT CURRENT_TIMESTAMP, details TEXT, status TEXT, room_count INTEGER, duration_ms INTEGER)'''
+    activity_daily_table_sql = '''CREATE TABLE IF NOT EXISTS activity_daily (day TEXT PRIMARY KEY, success_count INTEGER NOT NULL DEFAULT 0, error_count INTEGER NOT NULL DEFAULT 0)'''
+    activity_archive_table_sql = f'''CREATE TABLE IF NOT EXISTS activity_archive (day TEXT PRIMARY KEY, success_count INTEGER NOT NULL DEFAULT 0, error_count INTEGER NOT NULL DEFAULT 0, total_duration_ms INTEGER NOT NULL DEFAULT 0, payload {'BYTEA' if is_postgres else 'BLOB'})'''
+    dialog_cache_table_sql = '''CREATE TABLE IF NOT EXISTS dialog_cache (dialog_id TEXT PRIMARY KEY, name TEXT, dialog_type TEXT, last_message_at BIGINT, synced_at BIGINT)'''
+    sync_state_table_sql = '''CREATE TABLE IF NOT EXISTS sync_state (name TEXT PRIMARY KEY, value TEXT)'''
+    telegram_entities_table_sql = '''CREATE TABLE IF NOT EXISTS telegram_entities (id BIGINT PRIMARY KEY, hash BIGINT NOT NULL, username TEXT, phone TEXT, name TEXT)'''
+    with transaction():
+        execute_db(config_table_sql)
+        execute_db(promo_rooms_table_sql)
+        execute_db(activity_log_table_sql)
+        execute_db(activity_daily_table_sql)
+        migrate_activity_log()
+        execute_db(activity_archive_table_sql)
+        execute_db(dialog_cache_table_sql)
+        execute_db(sync_state_table_sql)
+        execute_db(telegram_entities_table_sql)
+        execute_db("CREATE INDEX IF NOT EXISTS idx_activity_log_timestamp ON activity_log (timestamp)")
+        execute_db("CREATE INDEX IF NOT EXISTS idx_activity_log_status_id ON activity_log (status, id)")
+        execute_db("CREATE INDEX IF NOT EXISTS idx_promo_rooms_group_id ON promo_rooms (room_group, id)")
+        if not query_db("SELECT id FROM config WHERE id = 1", one=True):
+            execute_db("INSERT INTO config (id, message, photo, interval_min, interval_max, scheduler_status, preview_id) VALUES (?, ?, ?, ?, ?, ?, ?)", (1, '', '', 30, 40, 'running', ''))
+
+# --- 홍보방 일괄 등록 ---
+def new_import_counts():
+    return {'inserted': 0, 'duplicate': 0, 'malformed': 0}
+
+def bulk_upsert_rooms(rows, chunk_size=ROOM_IMPORT_CHUNK, counts=None):
+    """(chat_id, room_name, room_group) 행들을 chunk_size 단위 트랜잭션으로 등록합니다.
+
+    이미 있는 chat_id는 건너뛰고, 추가/중복/잘못된 행 수를 dict로 돌려줍니다.
+    counts를 넘기면 그 dict에 누적하므로, rows를 만드는 쪽에서 걸러 낸 행도 함께 셀 수 있습니다.
+    """
+    counts = new_import_counts() if counts is None else counts
+
+    def flush(chunk):
+        with transaction():
+            inserted = insert_many('promo_rooms', ('chat_id', 'room_name', 'room_group'), chunk, on_conflict="(chat_id) DO NOTHING")
+        counts['inserted'] += inserted
+        counts['duplicate'] += len(chunk) - inserted
+
+    chunk = []
+    for row in rows:
+        if len(row) < 3 or not str(row[0]).strip():
+            counts['malformed'] += 1
+            continue
+        chunk.append((str(row[0]).strip(), row[1], row[2]))
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+    return counts
+
+def format_import_counts(counts):
+    return f"추가 {counts['inserted']}개, 중복 {counts['duplicate']}개, 잘못된 행 {counts['malformed']}개"
 
 # --- Telethon(Userbot) 핵심 로직 ---
 async def send_userbot_message(client, chat_id, message_template, photo_message_id):
@@ -123,7 +311,7 @@ async def send_userbot_message(client, chat_id, message_template, photo_message_
     else:
         await client.send_message(target_entity, final_message)
 
-async def scheduled_send():
+async def scheduled_send(client):
     config = query_db("SELECT * FROM config WHERE id = 1", one=True)
     if not config or config.get('scheduler_status') != 'running':
         print("스케줄러가 '일시정지' 상태이거나 설정이 없습니다.")
@@ -131,13 +319,12 @@ async def scheduled_send():
 
     active_rooms = query_db("SELECT chat_id FROM promo_rooms WHERE is_active = 1")
     log_detail = ""
-    client = TelegramClient(StringSession(SESSION_STRING), int(API_ID), API_HASH)
+    started_at = time.monotonic()
     
     try:
         if not config.get('message') or not active_rooms:
             raise ValueError("홍보 메시지 또는 대상 방이 설정되지 않았습니다.")
         
-        await client.connect()
         photo_msg_id = config.get('photo')
 
         for room in active_rooms:
@@ -156,14 +343,210 @@ async def scheduled_send():
     except Exception as e:
         log_detail = f"❌ [Userbot] 스케줄러 오류: {e}"
     finally:
-        if client.is_connected():
-            await client.disconnect()
-        execute_db("INSERT INTO activity_log (details) VALUES (?)", (log_detail,))
+        status = 'success' if log_detail.startswith('✅') else 'error'
+        duration_ms = int((time.monotonic() - started_at) * 1000)
+        log_activity(log_detail, status, room_count=len(active_rooms), duration_ms=duration_ms)
         print(log_detail)
 
+# --- 대화방 목록 캐시 ---
+_dialog_refresh_lock = threading.Lock()
+_dialog_refresh_started_at = 0
+_dialog_refresh_future = None
+
+def dialog_type_of(dialog):
+    dialog_type = "유저"
+    if dialog.is_group: dialog_type = "그룹"
+    if dialog.is_channel: dialog_type = "채널"
+    return dialog_type
+
+async def refresh_dialog_cache(client, full=False):
+    """Userbot의 대화방 목록을 dialog_cache 테이블에 동기화합니다.
+
+    iter_dialogs()는 마지막 메시지 시간 역순이므로, 증분 동기화는 지난 동기화 이후 바뀐 대화방까지만 읽고 멈춥니다.
+    전체 동기화(하루 1회 또는 full=True)에서는 더 이상 참여하지 않는 대화방도 캐시에서 지웁니다.
+    synced_at 값은 밀리초 단위 epoch 입니다. DB 작업은 텔레그램 이벤트 루프를 막지 않도록 별도 스레드에서 실행합니다.
+    """
+    state = await asyncio.to_thread(get_sync_state, 'dialogs')
+    run_at = int(time.time() * 1000)
+    full = full or not state or run_at - state.get('full_synced_at', 0) > DIALOG_FULL_SYNC_INTERVAL * 1000
+    watermark = 0 if full else state['watermark'] - 60
+    newest = state.get('watermark', 0)
+    rows = []
+    async for dialog in client.iter_dialogs():
+        message_at = int(dialog.date.timestamp()) if dialog.date else 0
+        # 고정된 대화방은 날짜와 무관하게 맨 위에 오므로 중단 기준에서 제외합니다.
+        if not full and not dialog.pinned and message_at < watermark:
+            break
+        newest = max(newest, message_at)
+        rows.append((str(dialog.id), dialog.name, dialog_type_of(dialog), message_at, run_at))
+
+    def save():
+        with transaction():
+            for start in range(0, len(rows), ROOM_IMPORT_CHUNK):
+                insert_many('dialog_cache', ('dialog_id', 'name', 'dialog_type', 'last_message_at', 'synced_at'), rows[start:start + ROOM_IMPORT_CHUNK],
+                            on_conflict="(dialog_id) DO UPDATE SET name = excluded.name, dialog_type = excluded.dialog_type, last_message_at = excluded.last_message_at, synced_at = excluded.synced_at")
+            if full:
+                execute_db("DELETE FROM dialog_cache WHERE synced_at < ?", (run_at,))
+            set_sync_state('dialogs', {'synced_at': run_at, 'watermark': newest, 'full_synced_at': run_at if full else state.get('full_synced_at', 0)})
+
+    await asyncio.to_thread(save)
+    print(f"대화방 목록 {'전체' if full else '증분'} 동기화: {len(rows)}개 갱신")
+    return len(rows)
+
+def start_dialog_refresh(full=False):
+    # 이미 갱신 중이면 새로 시작하지 않고 False를 돌려줍니다. 진행 중인 작업은 _dialog_refresh_future로 기다릴 수 있습니다.
+    global _dialog_refresh_started_at, _dialog_refresh_future
+    if not _dialog_refresh_lock.acquire(blocking=False):
+        return False
+    _dialog_refresh_started_at = time.time()
+
+    def done(future):
+        try:
+            future.result()
+        except Exception as e:
+            print(f"대화방 목록 갱신 오류: {e}")
+        finally:
+            _dialog_refresh_lock.release()
+
+    try:
+        _dialog_refresh_future = telegram.submit_nowait(refresh_dialog_cache, full)
+        _dialog_refresh_future.add_done_callback(done)
+    except Exception:
+        _dialog_refresh_lock.release()
+        raise
+    return True
+
+def dialog_refresh_status():
+    synced_at = get_sync_state('dialogs').get('synced_at')
+    return {
+        'refreshing': _dialog_refresh_lock.locked(),
+        'synced_at': datetime.datetime.fromtimestamp(synced_at / 1000, KST).strftime("%Y-%m-%d %H:%M:%S") if synced_at else None,
+        'is_stale': not synced_at or time.time() - synced_at / 1000 > DIALOG_CACHE_TTL,
+    }
+
+# --- 홍보방 상태 확인 (백그라운드 작업) ---
+_room_check_lock = threading.Lock()
+_room_check_future = None
+
+class FloodBackoff:
+    # FloodWait가 나면 모든 동시 작업이 같은 시각까지 함께 쉬도록 대기 시각을 공유합니다.
+    def __init__(self, on_wait=None):
+        self.until = 0
+        self.on_wait = on_wait
+
+    def remaining(self):
+        return max(0, self.until - time.monotonic())
+
+    def hit(self, seconds):
+        self.until = max(self.until, time.monotonic() + seconds + 1)
+        if self.on_wait:
+            self.on_wait()
+
+async def resolve_room_status(client, chat_id, backoff):
+    while True:
+        if backoff.remaining():
+            await asyncio.sleep(backoff.remaining())
+            continue
+        try:
+            entity = await client.get_entity(int(chat_id))
+            return f"✅ OK ({getattr(entity, 'title', 'N/A')})"
+        except FloodWaitError as e:
+            backoff.hit(e.seconds)
+        except Exception as e:
+            return f"❌ Error: {e.__class__.__name__}"
+
+def room_check_progress():
+    # 하트비트가 끊긴 'running' 작업은 중단된 것으로 보고, 다음 실행 때 이어서 진행합니다.
+    progress = get_sync_state('room_check')
+    if progress.get('status') == 'running' and time.time() > progress.get('alive_until', 0):
+        progress['status'] = 'interrupted'
+    return progress
+
+def new_room_check_state(progress):
+    # 중단/실패한 작업은 저장된 위치(last_id)부터 이어가고, 그 외에는 처음부터 새로 시작합니다.
+    if progress.get('status') in ('interrupted', 'failed') and progress.get('last_id'):
+        return progress
+    total = query_db("SELECT COUNT(*) AS count FROM promo_rooms", one=True)['count']
+    return {'total': total, 'checked': 0, 'errors': 0, 'last_id': 0, 'started_at': datetime.datetime.now(KST).strftime("%Y-%m-%d %H:%M:%S")}
+
+async def run_room_check(client, state):
+    """모든 홍보방을 id 순서대로 ROOM_CHECK_BATCH개씩 확인하고, 배치마다 결과와 진행 상황을 한 트랜잭션으로 저장합니다.
+
+    배치 안에서는 최대 ROOM_CHECK_CONCURRENCY개를 동시에 조회하며, 중단되면 마지막으로 저장한 방 다음부터 이어서 확인합니다.
+    """
+    semaphore = asyncio.Semaphore(ROOM_CHECK_CONCURRENCY)
+    # DB 작업은 텔레그램 이벤트 루프를 막지 않도록 전용 스레드 하나에서 순서대로 실행합니다.
+    # (SQLite 쓰기 잠금을 기다리는 동안에도 발송/미리보기 등 다른 submit이 멈추지 않습니다)
+    loop = asyncio.get_running_loop()
+    db_thread = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='room-check-db')
+
+    def run_db(func, *args):
+        return loop.run_in_executor(db_thread, func, *args)
+
+    def save(**changes):
+        state.update(changes, alive_until=time.time() + ROOM_CHECK_HEARTBEAT + backoff.remaining())
+        return run_db(set_sync_state, 'room_check', dict(state))
+
+    def save_batch(rooms, statuses, snapshot):
+        with transaction():
+            execute_many("UPDATE promo_rooms SET last_status = ? WHERE id = ?", [(status, room['id']) for status, room in zip(statuses, rooms)])
+            set_sync_state('room_check', snapshot)
+
+    async def check(room):
+        async with semaphore:
+            return await resolve_room_status(client, room['chat_id'], backoff)
+
+    backoff = FloodBackoff(on_wait=save)
+    try:
+        while True:
+            rooms = await run_db(query_db, "SELECT id, chat_id FROM promo_rooms WHERE id > ? ORDER BY id LIMIT ?", (state['last_id'], ROOM_CHECK_BATCH))
+            if not rooms:
+                break
+            statuses = await asyncio.gather(*(check(room) for room in rooms))
+            state.update(last_id=rooms[-1]['id'], checked=state['checked'] + len(rooms), errors=state['errors'] + sum(1 for status in statuses if status.startswith('❌')),
+                         alive_until=time.time() + ROOM_CHECK_HEARTBEAT + backoff.remaining())
+            await run_db(save_batch, rooms, statuses, dict(state))
+        await save(status='done', finished_at=datetime.datetime.now(KST).strftime("%Y-%m-%d %H:%M:%S"))
+    except Exception as e:
+        await save(status='failed', error=str(e))
+        raise
+    finally:
+        db_thread.shutdown(wait=False)
+    return state
+
+def start_room_check():
+    # 진행 중인 작업이 없을 때만 시작합니다. 중단/실패한 작업이 있으면 이어서 확인합니다.
+    global _room_check_future
+
+    def done(future):
+        # 취소된 Future에 exception()을 부르면 CancelledError가 나므로 먼저 확인합니다.
+        if future.cancelled():
+            print("홍보방 상태 확인이 취소되었습니다.")
+        elif future.exception() is not None:
+            print(f"홍보방 상태 확인 오류: {future.exception()}")
+
+    with _room_check_lock:
+        if _room_check_future is not None and not _room_check_future.done():
+            return False
+        progress = room_check_progress()
+        if progress.get('status') == 'running':
+            return False
+        # 응답 전에 'running' 상태를 먼저 저장해 두어야 곧바로 폴링해도 이전 결과가 보이지 않습니다.
+        state = new_room_check_state(progress)
+        state.update(status='running', finished_at=None, error=None, alive_until=time.time() + ROOM_CHECK_HEARTBEAT)
+        set_sync_state('room_check', state)
+        _room_check_future = telegram.submit_nowait(run_room_check, state)
+        _room_check_future.add_done_callback(done)
+        return True
+
 # --- 스케줄러 설정 ---
+# 발송 일시정지는 promo_job만 멈춥니다. (로그 보관 등 다른 작업은 계속 실행)
 scheduler = BackgroundScheduler(daemon=True, timezone='Asia/Seoul')
 
+def promo_job_state():
+    job = scheduler.get_job('promo_job')
+    return STATE_RUNNING if job is not None and job.next_run_time is not None else STATE_PAUSED
+
 # --- 로그인 / 로그아웃 라우트 ---
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -176,6 +559,15 @@ def login():
             error = '아이디 또는 비밀번호가 올바르지 않습니다.'
     return render_template('login.html', error=error)
 
+@app.route('/metrics')
+def metrics_page():
+    # Prometheus 수집기는 로그인할 수 없으므로 METRICS_TOKEN을 Bearer 토큰으로 보내면 허용합니다.
+    authorization = request.headers.get('Authorization', '')
+    has_token = bool(METRICS_TOKEN) and hmac.compare_digest(authorization.encode(), f"Bearer {METRICS_TOKEN}".encode())
+    if not has_token and 'logged_in' not in session:
+        return Response("Unauthorized", 401, {'WWW-Authenticate': 'Bearer'})
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/logout')
 @login_required
 def logout():
@@ -194,15 +586,72 @@ async def admin_page():
         # 이 부분은 이제 /save_config로 이동됨
         pass
 
-    today = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9))).strftime("%Y-%m-%d")
-    sent_today_query = "SELECT COUNT(*) as count FROM activity_log WHERE details LIKE '✅%%' AND DATE(timestamp, '+9 hours') = ?" if not DATABASE_URL else "SELECT COUNT(*) as count FROM activity_log WHERE details LIKE '✅%%' AND (timestamp AT TIME ZONE 'utc' AT TIME ZONE 'Asia/Seoul')::date = CURRENT_DATE"
-    sent_today = query_db(sent_today_query, (today,) if not DATABASE_URL else (), one=True)['count']
-    log_query = "SELECT strftime('%Y-%m-%d %H:%M:%S', timestamp, '+9 hours') as ts, details FROM activity_log ORDER BY id DESC LIMIT 5" if not DATABASE_URL else "SELECT to_char(timestamp AT TIME ZONE 'Asia/Seoul', 'YYYY-MM-DD HH24:MI:SS') as ts, details FROM activity_log ORDER BY id DESC LIMIT 5"
-    recent_logs = query_db(log_query)
-    promo_rooms = query_db("SELECT * FROM promo_rooms ORDER BY room_group, room_name")
+    today = datetime.datetime.now(KST).strftime("%Y-%m-%d")
+    daily = query_db("SELECT success_count FROM activity_daily WHERE day = ?", (today,), one=True)
+    sent_today = daily['success_count'] if daily else 0
+    recent_logs, _ = fetch_logs(limit=5)
+    room_groups = fetch_room_groups()
     config = query_db("SELECT * FROM config WHERE id = 1", one=True)
-    dashboard_data = {'sent_today': sent_today, 'recent_logs': recent_logs, 'room_count': len(promo_rooms)}
-    return render_template('admin.html', config=config, message=page_message, dashboard=dashboard_data, promo_rooms=promo_rooms, scheduler_state=scheduler.state)
+    dashboard_data = {'sent_today': sent_today, 'recent_logs': recent_logs, 'room_count': sum(group['room_count'] for group in room_groups)}
+    return render_template('admin.html', config=config, message=page_message, dashboard=dashboard_data, room_groups=room_groups, scheduler_state=promo_job_state())
+
+@app.route('/api/rooms')
+@login_required
+def rooms_api():
+    limit = min(max(request.args.get('limit', ROOM_PAGE_SIZE, type=int), 1), ROOM_PAGE_MAX)
+    rooms, next_after_id = fetch_rooms(
+        after_id=request.args.get('after_id', type=int),
+        # group 파라미터가 있으면 빈 문자열이어도 그 그룹만, group_null=1이면 그룹이 없는(NULL) 방만 가져옵니다.
+        group=request.args.get('group'),
+        group_is_null=request.args.get('group_null', 0, type=int) == 1,
+        is_active=request.args.get('is_active', type=int),
+        last_status=request.args.get('last_status'),
+        limit=limit)
+    return jsonify({'rooms': rooms, 'next_after_id': next_after_id})
+
+@app.route('/api/rooms/groups')
+@login_required
+def room_groups_api():
+    return jsonify({'groups': fetch_room_groups()})
+
+def log_filters_from_request():
+    limit = min(request.args.get('limit', LOG_PAGE_SIZE, type=int), LOG_PAGE_MAX)
+    return {
+        'before_id': request.args.get('before_id', type=int),
+        'status': request.args.get('status') or None,
+        'date_from': request.args.get('date_from') or None,
+        'date_to': request.args.get('date_to') or None,
+        'limit': max(limit, 1),
+    }
+
+@app.route('/logs')
+@login_required
+def logs_page():
+    filters = log_filters_from_request()
+    try:
+        logs, next_before_id = fetch_logs(**filters)
+    except ValueError:
+        return "날짜 형식은 YYYY-MM-DD 입니다.", 400
+    archives = query_db("SELECT day, success_count, error_count, total_duration_ms FROM activity_archive ORDER BY day DESC LIMIT 30")
+    return render_template('logs.html', logs=logs, next_before_id=next_before_id, filters=filters, archives=archives)
+
+@app.route('/api/logs')
+@login_required
+def logs_api():
+    try:
+        logs, next_before_id = fetch_logs(**log_filters_from_request())
+    except ValueError:
+        return jsonify({'message': '날짜 형식은 YYYY-MM-DD 입니다.'}), 400
+    return jsonify({'logs': logs, 'next_before_id': next_before_id})
+
+@app.route('/api/logs/archive/<string:day>')
+@login_required
+def log_archive_api(day):
+    archive = query_db("SELECT day, success_count, error_count, total_duration_ms, payload FROM activity_archive WHERE day = ?", (day,), one=True)
+    if not archive:
+        return jsonify({'message': '보관된 로그가 없습니다.'}), 404
+    archive['entries'] = json.loads(zlib.decompress(bytes(archive.pop('payload'))))
+    return jsonify(archive)
 
 @app.route('/save_config', methods=['POST'])
 @login_required
@@ -218,27 +667,26 @@ def save_config():
 
     if interval_min != current_config['interval_min'] or interval_max != current_config['interval_max']:
         next_run_minutes = random.randint(interval_min, interval_max)
+        was_paused = promo_job_state() == STATE_PAUSED
         scheduler.reschedule_job('promo_job', trigger='interval', minutes=next_run_minutes)
+        # reschedule_job은 다음 실행 시각을 다시 잡아 일시정지를 풀어 버리므로 상태를 되돌립니다.
+        if was_paused:
+            scheduler.pause_job('promo_job')
         print(f"스케줄러 간격 변경. 다음 실행은 약 {next_run_minutes}분 후.")
     
     return redirect(url_for('admin_page', message="✅ 설정이 성공적으로 저장되었습니다."))
 
 
 @app.route('/preview', methods=['POST'])
-@async_login_required
-async def preview_message():
+@login_required
+def preview_message():
     try:
         preview_id, message_template = request.form.get('preview_id'), request.form.get('message')
         photo_msg_id = request.form.get('photo')
         if not preview_id or not message_template: return jsonify({'message': 'ID와 메시지를 입력해주세요.'}), 400
 
-        client = TelegramClient(StringSession(SESSION_STRING), int(API_ID), API_HASH)
-        await client.connect()
-        try:
-            await send_userbot_message(client, preview_id, message_template, photo_msg_id)
-            return jsonify({'message': f'✅ {preview_id}로 미리보기 발송 성공.'})
-        finally:
-            if client.is_connected(): await client.disconnect()
+        telegram.submit(send_userbot_message, preview_id, message_template, photo_msg_id)
+        return jsonify({'message': f'✅ {preview_id}로 미리보기 발송 성공.'})
     except Exception as e:
         return jsonify({'message': f'❌ 미리보기 전송 실패: {e}'}), 500
 
@@ -274,28 +722,56 @@ def delete_all_rooms():
 def import_rooms():
     file = request.files.get('file')
     if not file: return "파일이 없습니다.", 400
-    stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
+    counts = new_import_counts()
+    invalid = {'count': 0, 'first_line': None}
+    failure = {}
+    # 업로드를 조금씩 디코딩하며 읽으므로 파일 크기와 관계없이 메모리 사용량이 일정합니다. (newline=None으로 \r, \r\n 줄바꿈도 처리)
+    # UTF-8이 아닌 바이트는 surrogateescape로 남겨 두었다가 그 행만 잘못된 행으로 셉니다.
+    stream = io.TextIOWrapper(file.stream, encoding='utf-8-sig', errors='surrogateescape', newline=None)
     reader = csv.reader(stream)
-    next(reader, None)
-    for row in reader:
-        if len(row) >= 3:
-            try:
-                execute_db("INSERT INTO promo_rooms (chat_id, room_name, room_group) VALUES (?, ?, ?) ON CONFLICT (chat_id) DO NOTHING", (row[0], row[1], row[2]))
-            except (psycopg2.IntegrityError, sqlite3.IntegrityError):
-                continue
-    return "가져오기 완료!"
+
+    def valid_rows():
+        # 앞 조각은 이미 커밋되었을 수 있으므로, CSV 형식 오류가 나면 그때까지 읽은 행만 등록하고 결과를 알려 줍니다.
+        try:
+            next(reader, None)
+            for row in reader:
+                if any(ESCAPED_BYTES.search(cell) for cell in row):
+                    counts['malformed'] += 1
+                    invalid['count'] += 1
+                    invalid['first_line'] = invalid['first_line'] or reader.line_num
+                    continue
+                yield row
+        except csv.Error as e:
+            failure.update(line=reader.line_num, error=str(e))
+
+    try:
+        bulk_upsert_rooms(valid_rows(), counts=counts)
+    finally:
+        stream.detach()
+    if failure:
+        return f"{failure['line']}번째 줄에서 CSV 형식 오류로 가져오기를 중단했습니다: {failure['error']} (그 전까지: {format_import_counts(counts)})", 400
+    message = f"가져오기 완료! {format_import_counts(counts)}"
+    if invalid['count']:
+        message += f" (UTF-8이 아닌 행 {invalid['count']}개 제외, 처음 나온 줄: {invalid['first_line']}번째)"
+    return message
 
 @app.route('/export_rooms')
 @login_required
 def export_rooms():
-    rows = query_db("SELECT chat_id, room_name, room_group FROM promo_rooms")
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Chat ID', 'Room Name', 'Group'])
-    for row in rows:
-        writer.writerow([row['chat_id'], row['room_name'], row['room_group']])
-    encoded_output = output.getvalue().encode('utf-8-sig')
-    return Response(encoded_output, mimetype="text/csv", headers={"Content-Disposition":"attachment;filename=rooms.csv"})
+    def generate():
+        # 서버 측 커서에서 읽은 행을 약 EXPORT_FLUSH_BYTES 단위로 모아 바로 내보냅니다.
+        output = io.StringIO()
+        writer = csv.writer(output)
+        yield codecs.BOM_UTF8
+        writer.writerow(['Chat ID', 'Room Name', 'Group'])
+        for row in iter_query("SELECT chat_id, room_name, room_group FROM promo_rooms ORDER BY id", batch_size=ROOM_IMPORT_CHUNK):
+            writer.writerow([row['chat_id'], row['room_name'], row['room_group']])
+            if output.tell() >= EXPORT_FLUSH_BYTES:
+                yield output.getvalue().encode('utf-8')
+                output.seek(0)
+                output.truncate()
+        yield output.getvalue().encode('utf-8')
+    return Response(generate(), mimetype="text/csv", headers={"Content-Disposition":"attachment;filename=rooms.csv"})
 
 @app.route('/toggle_scheduler/<string:action>', methods=['POST'])
 @login_required
@@ -303,89 +779,86 @@ def toggle_scheduler(action):
     status_to_set = 'paused' if action == 'pause' else 'running'
     try:
         if action == 'pause':
-            scheduler.pause()
+            scheduler.pause_job('promo_job')
         elif action == 'resume':
-            scheduler.resume()
+            scheduler.resume_job('promo_job')
         execute_db("UPDATE config SET scheduler_status = ? WHERE id = 1", (status_to_set,))
         return f"스케줄러가 {status_to_set} 상태가 되었습니다."
     except Exception as e:
         return f"오류 발생: {e}", 500
 
 @app.route('/check_rooms', methods=['POST'])
-@async_login_required
-async def check_rooms():
-    rooms = query_db("SELECT id, chat_id FROM promo_rooms")
-    client = TelegramClient(StringSession(SESSION_STRING), int(API_ID), API_HASH)
-    await client.connect()
-    
-    for room in rooms:
-        status = ''
-        try:
-            entity = await client.get_entity(int(room['chat_id']))
-            status = f"✅ OK ({getattr(entity, 'title', 'N/A')})"
-        except Exception as e:
-            status = f"❌ Error: {e.__class__.__name__}"
-        
-        execute_db("UPDATE promo_rooms SET last_status = ? WHERE id = ?", (status, room['id']))
-            
-    await client.disconnect()
-    return "상태 확인 완료!"
+@login_required
+def check_rooms():
+    started = start_room_check()
+    progress = room_check_progress()
+    if not started:
+        return jsonify({'message': '이미 상태 확인이 진행 중입니다.', 'progress': progress}), 409
+    return jsonify({'message': '상태 확인을 시작했습니다.', 'progress': progress}), 202
+
+@app.route('/check_rooms/status')
+@login_required
+def check_rooms_status():
+    return jsonify(room_check_progress())
 
 @app.route('/dialogs')
-@async_login_required
-async def dialogs_page():
-    client = TelegramClient(StringSession(SESSION_STRING), int(API_ID), API_HASH)
-    dialog_list = []
-    try:
-        await client.connect()
-        registered_rooms = query_db("SELECT chat_id FROM promo_rooms")
-        registered_ids = {str(room['chat_id']) for room in registered_rooms}
-        async for dialog in client.iter_dialogs():
-            dialog_type = "유저"
-            if dialog.is_group: dialog_type = "그룹"
-            if dialog.is_channel: dialog_type = "채널"
-            dialog_list.append({'name': dialog.name, 'id': dialog.id, 'type': dialog_type, 'is_registered': str(dialog.id) in registered_ids})
-    except Exception as e:
-        print(f"대화방 목록 로딩 오류: {e}")
-    finally:
-        if client.is_connected():
-            await client.disconnect()
-    return render_template('dialogs.html', dialogs=dialog_list)
+@login_required
+def dialogs_page():
+    # 캐시된 목록을 바로 보여주고, 오래됐으면 백그라운드에서 갱신합니다.
+    status = dialog_refresh_status()
+    # 갱신이 실패해도 TTL 동안은 자동으로 다시 시도하지 않습니다.
+    auto_refresh = status['is_stale'] and time.time() - _dialog_refresh_started_at > DIALOG_CACHE_TTL
+    if request.args.get('refresh') or auto_refresh:
+        status['refreshing'] = start_dialog_refresh(full=request.args.get('refresh') == 'full') or status['refreshing']
+    dialog_list = query_db("""SELECT d.dialog_id AS id, d.name, d.dialog_type AS type, CASE WHEN p.chat_id IS NULL THEN 0 ELSE 1 END AS is_registered
+        FROM dialog_cache d LEFT JOIN promo_rooms p ON p.chat_id = d.dialog_id ORDER BY d.last_message_at DESC""")
+    return render_template('dialogs.html', dialogs=dialog_list, status=status)
+
+@app.route('/api/dialogs/status')
+@login_required
+def dialogs_status_api():
+    return jsonify(dialog_refresh_status())
 
 @app.route('/register_all', methods=['POST'])
-@async_login_required
-async def register_all():
-    client = TelegramClient(StringSession(SESSION_STRING), int(API_ID), API_HASH)
+@login_required
+def register_all():
+    # 캐시를 갱신(또는 이미 진행 중인 갱신)을 최대 REGISTER_REFRESH_TIMEOUT초 기다린 뒤, 그때의 캐시로 등록합니다.
+    refreshed = False
+    try:
+        start_dialog_refresh()
+        future = _dialog_refresh_future
+        if future is not None:
+            concurrent.futures.wait([future], timeout=REGISTER_REFRESH_TIMEOUT)
+            refreshed = future.done() and not future.cancelled() and future.exception() is None
+    except Exception as e:
+        print(f"전체 등록 전 목록 갱신 오류: {e}")
     try:
-        await client.connect()
-        registered_rooms = query_db("SELECT chat_id FROM promo_rooms")
-        registered_ids = {str(room['chat_id']) for room in registered_rooms}
-        count = 0
-        async for dialog in client.iter_dialogs():
-            if (dialog.is_group or dialog.is_channel) and str(dialog.id) not in registered_ids:
-                execute_db("INSERT INTO promo_rooms (chat_id, room_name, room_group) VALUES (?, ?, ?) ON CONFLICT (chat_id) DO NOTHING",(str(dialog.id), dialog.name, '기본'))
-                count += 1
-        print(f"{count}개의 새로운 방을 등록했습니다.")
+        rows = [(room['dialog_id'], room['name'], '기본') for room in query_db("SELECT dialog_id, name FROM dialog_cache WHERE dialog_type IN (?, ?)", ('그룹', '채널'))]
+        counts = bulk_upsert_rooms(rows)
+        print(f"{counts['inserted']}개의 새로운 방을 등록했습니다. ({format_import_counts(counts)})")
+        message = f"미등록 그룹/채널 {counts['inserted']}개를 등록했습니다. ({format_import_counts(counts)})"
+        if not refreshed:
+            synced_at = dialog_refresh_status()['synced_at'] or '없음'
+            message += f"\n대화방 목록 갱신이 아직 끝나지 않아 마지막 동기화({synced_at}) 기준으로 등록했습니다. 갱신이 끝난 뒤 다시 누르면 나머지도 등록됩니다."
     except Exception as e:
         print(f"전체 등록 중 오류: {e}")
-    finally:
-        if client.is_connected():
-            await client.disconnect()
-    return "<script>alert('미등록된 그룹/채널을 모두 등록했습니다!'); window.location.href='/dialogs';</script>"
+        message = f"전체 등록 중 오류가 발생했습니다: {e}"
+    return f"<script>alert({json.dumps(message)}); window.location.href='/dialogs';</script>"
 
 @app.route('/register_selected', methods=['POST'])
 @login_required
 def register_selected():
     selected_rooms = request.form.getlist('selected_rooms')
-    count = 0
-    for room_data in selected_rooms:
-        chat_id, room_name = room_data.split('|', 1)
-        try:
-            execute_db("INSERT INTO promo_rooms (chat_id, room_name, room_group) VALUES (?, ?, ?) ON CONFLICT (chat_id) DO NOTHING",(chat_id, room_name, '기본'))
-            count += 1
-        except Exception as e:
-            print(f"선택 등록 중 오류: {e}")
-    return f"<script>alert('{count}개의 방을 선택하여 등록했습니다!'); window.location.href='/dialogs';</script>"
+    rows = [room_data.split('|', 1) + ['기본'] for room_data in selected_rooms]
+    # 오류가 나도 그 전에 커밋된 조각까지의 실제 결과를 알려 줍니다.
+    counts = new_import_counts()
+    try:
+        bulk_upsert_rooms(rows, counts=counts)
+        message = f"{counts['inserted']}개의 방을 선택하여 등록했습니다! ({format_import_counts(counts)})"
+    except Exception as e:
+        print(f"선택 등록 중 오류: {e}")
+        message = f"선택 등록 중 오류가 발생했습니다: {e}\n오류 전까지: {format_import_counts(counts)}"
+    return f"<script>alert({json.dumps(message)}); window.location.href='/dialogs';</script>"
 
 
 # --- 애플리케이션 실행 ---
@@ -396,11 +869,13 @@ interval_min = config['interval_min'] if config else 30
 interval_max = config['interval_max'] if config else 40
 initial_status = config['scheduler_status'] if config else 'running'
 
-scheduler.add_job(lambda: asyncio.run(scheduled_send()), 'interval', minutes=random.randint(interval_min, interval_max), id='promo_job')
+scheduler.add_job(lambda: telegram.submit(scheduled_send), 'interval', minutes=random.randint(interval_min, interval_max), id='promo_job')
+scheduler.add_job(compact_activity_log, 'cron', hour=4, id='log_compaction')
 scheduler.start()
+atexit.register(telegram.stop)
 
 if initial_status == 'paused':
-    scheduler.pause()
+    scheduler.pause_job('promo_job')
 
 if __name__ == '__main__':
     print("Userbot 데이터베이스와 스케줄러가 준비되었습니다.")